@@ -4,6 +4,14 @@ This file is automatically generated by the dynamic loading system.
 Do not edit manually - it will be overwritten when tools are loaded.
 """
 
-from .dataset_scalyr_query import dataset_scalyr_query
+from .dataset_scalyr_query import (
+    dataset_scalyr_query,
+    dataset_scalyr_query_batch,
+    dataset_scalyr_query_many,
+)
 
-__all__ = ["dataset_scalyr_query"]
+__all__ = [
+    "dataset_scalyr_query",
+    "dataset_scalyr_query_batch",
+    "dataset_scalyr_query_many",
+]
@@ -1,17 +1,310 @@
 """Dataset_scalyr_query tool for MCP server.
 """
 
+import asyncio
+import copy
 import os
 import json
+import math
+import re
+import threading
 from typing import Optional, Any
-import urllib.request
-import urllib.error
 
+import httpx
+import ijson  # type: ignore[import-untyped]
+import urllib3
+from cachetools import TTLCache
 from mcp.types import ToolAnnotations
 
 from core.server import mcp
 from core.utils import get_tool_config
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is a declared dependency
+    orjson = None  # type: ignore[assignment]
+
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize a request body to compact JSON bytes.
+
+    orjson never emits whitespace; the stdlib fallback needs explicit
+    separators to drop the default ", " and ": ".
+    """
+    if orjson is not None:
+        data: bytes = orjson.dumps(obj)
+        return data
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes) -> Any:
+    """Parse a JSON response body straight from bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Scalyr host (e.g. eu.scalyr.com), read once so the URL is never re-parsed
+_HOST = os.environ.get("SCALYR_HOST", "app.scalyr.com")
+
+# Shared keep-alive pool so repeated queries reuse the same TCP/TLS session
+_POOL = urllib3.HTTPSConnectionPool(
+    _HOST,
+    maxsize=10,
+    block=False,
+    retries=urllib3.Retry(total=2, backoff_factor=0.2),
+)
+
+# Request headers shared by every query
+_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept-Encoding": "gzip",
+}
+
+# API token and the fixed part of every request body, resolved once
+_TOKEN: Optional[str] = os.environ.get("SCALYR_API_TOKEN") or None
+_BODY_TEMPLATE: dict[str, Any] = {"token": _TOKEN, "queryType": "log"}
+
+
+# Largest maxCount accepted by /api/query
+_MAX_COUNT_LIMIT = 5000
+
+# Pages auto_paginate may fetch beyond ceil(auto_paginate / max_count), so a
+# few short pages are absorbed without following tokens indefinitely
+_AUTO_PAGINATE_EXTRA_PAGES = 2
+
+
+def _body_template() -> Optional[dict[str, Any]]:
+    """Return the static request body, resolving the API token on first use.
+
+    The token is memoized once found; while it is missing the environment is
+    re-read on every call so a late-loaded token is still picked up.
+    """
+    global _TOKEN, _BODY_TEMPLATE
+    if _TOKEN is None:
+        token = os.environ.get("SCALYR_API_TOKEN")
+        if not token:
+            return None
+        _TOKEN = token
+        _BODY_TEMPLATE = {"token": token, "queryType": "log"}
+    return _BODY_TEMPLATE
+
+
+def _validate_query(
+    start_time: object, end_time: object, max_count: object
+) -> Optional[str]:
+    """Return an error message for arguments the API would reject, else None.
+
+    Arguments are typed loosely because dataset_scalyr_query_many passes
+    values straight from caller-supplied dicts.
+    """
+    if (
+        not isinstance(max_count, int)
+        or isinstance(max_count, bool)
+        or not 1 <= max_count <= _MAX_COUNT_LIMIT
+    ):
+        return f"max_count must be an integer between 1 and {_MAX_COUNT_LIMIT}"
+    for name, value in (("start_time", start_time), ("end_time", end_time)):
+        # Scalyr accepts many time formats ("4h", "1w", "today", ISO dates),
+        # so only values that can't be a time at all are rejected here
+        if not isinstance(value, str) or not value.strip():
+            return f"{name} must be a non-empty string, got {value!r}"
+    return None
+
+
+def _build_body(
+    template: dict[str, Any],
+    filter: str,
+    start_time: str,
+    end_time: str,
+    max_count: int,
+    columns: str,
+    continuation_token: Optional[str],
+) -> dict[str, Any]:
+    """Build the /api/query request body on top of the static template."""
+    body = {
+        **template,
+        "filter": filter,
+        "startTime": start_time,
+        "endTime": end_time,
+        "maxCount": max_count,
+    }
+
+    # Only send columns when restricting the output fields
+    if columns:
+        body["columns"] = columns
+
+    # Add continuation token if provided
+    if continuation_token:
+        body["continuationToken"] = continuation_token
+
+    return body
+
+
+def _error_result(
+    status: int, reason: Optional[str], error_body: bytes
+) -> dict[str, Any]:
+    """Build the error dict returned for a non-2xx Scalyr response."""
+    # Only try to parse bodies that look like JSON; plain-text/HTML errors
+    # are decoded directly without raising and catching a decode error
+    error_details: Any
+    if error_body[:1] in (b"{", b"["):
+        try:
+            error_details = _loads(error_body)
+        except ValueError:
+            error_details = error_body.decode("utf-8", "replace")
+    else:
+        error_details = error_body.decode("utf-8", "replace")
+    return {
+        "error": f"HTTP {status}: {reason}",
+        "details": error_details
+    }
+
+
+def _post_query(body: dict[str, Any], stream: bool = False) -> dict[str, Any]:
+    """POST one query over the shared pool and return the parsed response.
+
+    With ``stream`` the body is parsed incrementally off the socket with ijson
+    instead of being buffered in full before parsing.
+    """
+    try:
+        data = _dumps(body)
+        response = _POOL.urlopen(
+            "POST",
+            "/api/query",
+            body=data,
+            headers=_HEADERS,
+            preload_content=not stream,
+        )
+
+        try:
+            if response.status >= 400:
+                return _error_result(response.status, response.reason, response.data)
+
+            if stream:
+                return dict(ijson.kvitems(response, "", use_float=True))
+
+            result: dict[str, Any] = _loads(response.data)
+            return result
+        finally:
+            if stream:
+                # Discard anything ijson left unread (e.g. after a parse error
+                # on a truncated body) before the socket goes back to the pool
+                response.drain_conn()
+                response.release_conn()
+
+    except urllib3.exceptions.HTTPError as e:
+        return {
+            "error": f"URL Error: {e}"
+        }
+    except Exception as e:
+        return {
+            "error": f"Unexpected error: {str(e)}"
+        }
+
+
+# Async batch settings: concurrent requests per call and attempts per query
+_ASYNC_CONCURRENCY = 8
+_ASYNC_ATTEMPTS = 3
+_ASYNC_URL = f"https://{_HOST}/api/query"
+
+def _new_client() -> httpx.AsyncClient:
+    """Create the HTTP/2 client used for one dataset_scalyr_query_many call.
+
+    Concurrent queries are multiplexed as streams over a single TLS
+    connection instead of queueing behind each other on HTTP/1.1 sockets.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        timeout=30.0,
+        headers=_HEADERS,
+    )
+
+
+async def _post_query_async(
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    body: dict[str, Any],
+) -> dict[str, Any]:
+    """POST one query, retrying with exponential backoff on 429/5xx."""
+    data = _dumps(body)
+    result: dict[str, Any] = {}
+    for attempt in range(_ASYNC_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(2**attempt * 0.1)
+        try:
+            async with sem:
+                response = await client.post(_ASYNC_URL, content=data)
+            if response.status_code < 400:
+                parsed: dict[str, Any] = _loads(response.content)
+                return parsed
+            result = _error_result(
+                response.status_code, response.reason_phrase, response.content
+            )
+            if response.status_code != 429 and response.status_code < 500:
+                return result
+        except httpx.TransportError as e:
+            result = {
+                "error": f"URL Error: {e}"
+            }
+    return result
+
+
+# Short-lived cache of identical queries over absolute time ranges
+_CACHE: TTLCache = TTLCache(maxsize=256, ttl=30)
+_CACHE_LOCK = threading.Lock()
+
+
+# A single `field == 'value'` clause, and the optional `and` joining clauses
+_CLAUSE_RE = re.compile(r"""\s*\$?([\w.]+)\s*==?\s*(?:'([^']*)'|"([^"]*)")\s*""")
+_CLAUSE_JOIN_RE = re.compile(r"\s*(?:(?:and|AND)\b|&&)?\s*")
+
+
+def _filter_clauses(filter: str) -> Optional[list[tuple[str, str]]]:
+    """Parse a filter made only of ANDed field equality clauses.
+
+    Returns the (field, value) pairs, or None when the filter uses anything
+    else (free text, other operators, or/not, grouping), in which case its
+    matches cannot be attributed client-side.
+    """
+    text = filter.strip()
+    clauses = []
+    pos = 0
+    while pos < len(text):
+        match = _CLAUSE_RE.match(text, pos)
+        if match is None:
+            return None
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        clauses.append((match.group(1), value))
+        join = _CLAUSE_JOIN_RE.match(text, match.end())
+        pos = join.end() if join else match.end()
+    return clauses or None
+
+
+def _event_matches(
+    event: dict[str, Any],
+    sessions: dict[str, Any],
+    clauses: list[tuple[str, str]],
+) -> bool:
+    """Check an event against field equality clauses.
+
+    Fields are looked up in the event attributes, then the event itself, then
+    the session it belongs to (serverHost and other session-level fields).
+    """
+    attributes = event.get("attributes") or {}
+    session_id = event.get("session")
+    session = sessions.get(session_id, {}) if isinstance(session_id, str) else {}
+    for field, value in clauses:
+        for source in (attributes, event, session):
+            if field in source:
+                if str(source[field]) != value:
+                    return False
+                break
+        else:
+            return False
+    return True
+
 
 @mcp.tool(
     annotations=ToolAnnotations(
@@ -26,15 +319,17 @@ def dataset_scalyr_query(
     max_count: int = 100,
     columns: str = "",
     continuation_token: Optional[str] = None,
+    auto_paginate: int = 0,
+    stream: bool = False,
 ) -> dict[str, Any]:
     """Query Scalyr logs API.
 
     Args:
         filter: Events to match, using the same syntax as the Expression field in the query UI. (e.g., "Environment = 'staging' Project = 'backend'" AccountGroup = 'product' 'error')
         
-        start_time: Start time for the query. You can also supply a simple timestamp, measured in seconds, milliseconds, or nanoseconds since 1/1/1970. (default: "4h")
+        start_time: Start time for the query, in any format Scalyr accepts: a time relative to now (e.g. "30m", "4h", "1d", "1w", "4 hours"), a date and time (e.g. "2024-01-15 10:00:00" or ISO 8601), a keyword such as "today", or a simple timestamp measured in seconds, milliseconds, or nanoseconds since 1/1/1970. (default: "4h")
         
-        end_time: End time for the query. You can also supply a simple timestamp, measured in seconds, milliseconds, or nanoseconds since 1/1/1970. (default: "0h")
+        end_time: End time for the query, in the same formats as start_time (e.g. "0h" for now). (default: "0h")
         
         max_count: Maximum number of records to return. You may specify a value from 1 to 5000. (default: 100)
         
@@ -42,60 +337,265 @@ def dataset_scalyr_query(
 
         continuation_token: [Optional] is used to page through result sets larger than max_count. Omit this parameter for your first query. You may then repeat the query with the same filter, start_time and end_time to retrieve further matches. Each time, set continuation_token to the value returned by the previous query. When using continuation_token, you should set start_time and end_time to absolute values, not relative values such as 4h. If you use relative time values, and the time range drifts so that the continuation token refers to an event that falls outside the new time range, the query will fail.
 
+        auto_paginate: [Optional] minimum number of matches to collect. When set, further pages of max_count matches are fetched automatically by following continuationToken until at least this many matches are returned or no more are available; the returned continuationToken (if any) continues after the last match. Use absolute start_time and end_time with this option. (default: 0, which fetches a single page)
+
+        stream: [Optional] parse the response incrementally as it arrives instead of buffering the whole body first. Reduces peak memory for very large result sets (e.g. max_count=5000 with many columns); the returned data is the same. (default: false)
+
     Returns:
         dict: Parsed JSON response from Scalyr API
     """
-    # Get Scalyr API token from environment variable
-    token = os.environ.get("SCALYR_API_TOKEN")
-    if not token:
+    # Reject arguments the API would refuse without a network round-trip
+    error = _validate_query(start_time, end_time, max_count)
+    if error:
+        return {
+            "error": error
+        }
+
+    # Get Scalyr API token (cached after the first successful lookup)
+    template = _body_template()
+    if template is None:
         return {
             "error": "SCALYR_API_TOKEN environment variable not set"
         }
 
+    # Relative times ("4h") move with the clock and continuation tokens are
+    # one-shot, so only first-page queries over absolute ranges are cached
+    cache_key = None
+    if continuation_token is None and start_time.isdigit() and end_time.isdigit():
+        cache_key = (filter, start_time, end_time, max_count, columns, auto_paginate)
+        with _CACHE_LOCK:
+            cached = _CACHE.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
     # Prepare the API request body
-    body = {
-        "token": token,
-        "queryType": "log",
-        "filter": filter,
-        "startTime": start_time,
-        "endTime": end_time,
-        "maxCount": max_count,
-        "columns": columns,
-    }
-    
-    # Add continuation token if provided
-    if continuation_token:
-        body["continuationToken"] = continuation_token
+    body = _build_body(
+        template, filter, start_time, end_time, max_count, columns, continuation_token
+    )
 
-    # Make the API request
-    url = "https://app.scalyr.com/api/query"
-    headers = {
-        "Content-Type": "application/json",
-    }
-    
-    try:
-        data = json.dumps(body).encode("utf-8")
-        req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-        
-        with urllib.request.urlopen(req) as response:
-            response_data = response.read().decode("utf-8")
-            return json.loads(response_data)
-            
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode("utf-8") if e.fp else str(e)
-        try:
-            error_details = json.loads(error_body)
-        except:
-            error_details = error_body
+    result = _post_query(body, stream)
+
+    # Follow continuation tokens on the same pooled connection until enough
+    # matches have been collected or the result set is exhausted
+    if auto_paginate and "error" not in result:
+        matches = result.setdefault("matches", [])
+        max_pages = math.ceil(auto_paginate / max_count) + _AUTO_PAGINATE_EXTRA_PAGES
+        pages = 1
+        while (
+            len(matches) < auto_paginate
+            and result.get("continuationToken")
+            and pages < max_pages
+        ):
+            token = result["continuationToken"]
+            body["continuationToken"] = token
+            page = _post_query(body, stream)
+            pages += 1
+            if "error" in page:
+                # Keep the matches collected so far and the last good
+                # continuationToken so the caller can resume from there
+                result.update(page)
+                break
+
+            page_matches = page.get("matches", [])
+            matches.extend(page_matches)
+            if page.get("sessions"):
+                result.setdefault("sessions", {}).update(page["sessions"])
+            next_token = page.get("continuationToken")
+            if next_token:
+                result["continuationToken"] = next_token
+            else:
+                result.pop("continuationToken", None)
+
+            # An empty page or a repeated token means the scan is not making
+            # progress; hand the token back to the caller instead of spinning
+            if not page_matches or next_token == token:
+                break
+
+    if cache_key is not None and "error" not in result:
+        with _CACHE_LOCK:
+            _CACHE[cache_key] = result
+        return copy.deepcopy(result)
+
+    return result
+
+
+@mcp.tool(
+    annotations=ToolAnnotations(
+        title="Dataset_scalyr_query_many",
+        readOnlyHint=True,
+    ),
+)
+async def dataset_scalyr_query_many(
+    queries: list[dict[str, Any]],
+) -> dict[str, Any]:
+    """Run several Scalyr log queries concurrently.
+
+    Args:
+        queries: List of queries to run. Each entry is an object with the same fields as dataset_scalyr_query: filter (required), start_time, end_time, max_count, columns and continuation_token. Use this instead of repeated dataset_scalyr_query calls when you need several independent queries, e.g. different filters or several pages.
+
+    Returns:
+        dict: {"results": [...]} with one parsed Scalyr response (or error dict) per query, in the same order as queries
+    """
+    template = _body_template()
+    if template is None:
         return {
-            "error": f"HTTP {e.code}: {e.reason}",
-            "details": error_details
+            "error": "SCALYR_API_TOKEN environment variable not set"
         }
-    except urllib.error.URLError as e:
+
+    sem = asyncio.Semaphore(_ASYNC_CONCURRENCY)
+
+    async def run(query: dict[str, Any]) -> dict[str, Any]:
+        # Entries come straight from the caller, so any malformed one must
+        # produce its own error instead of failing the whole gather
+        try:
+            if not isinstance(query.get("filter"), str) or not query["filter"]:
+                return {
+                    "error": "Each query requires a filter"
+                }
+            start_time = query.get("start_time", "4h")
+            end_time = query.get("end_time", "0h")
+            max_count = query.get("max_count", 100)
+            error = _validate_query(start_time, end_time, max_count)
+            if error:
+                return {
+                    "error": error
+                }
+            body = _build_body(
+                template,
+                query["filter"],
+                start_time,
+                end_time,
+                max_count,
+                query.get("columns", ""),
+                query.get("continuation_token"),
+            )
+            return await _post_query_async(client, sem, body)
+        except Exception as e:
+            return {
+                "error": f"Unexpected error: {str(e)}"
+            }
+
+    # Scope the client to this call so its connections are always closed
+    async with _new_client() as client:
+        results = await asyncio.gather(*(run(query) for query in queries))
+    return {"results": list(results)}
+
+
+@mcp.tool(
+    annotations=ToolAnnotations(
+        title="Dataset_scalyr_query_batch",
+        readOnlyHint=True,
+    ),
+)
+def dataset_scalyr_query_batch(
+    filters: list[str],
+    start_time: str = "4h",
+    end_time: str = "0h",
+    max_count: int = 100,
+    columns: str = "",
+) -> dict[str, Any]:
+    """Run several Scalyr log filters over the same time range in one request.
+
+    Args:
+        filters: List of filters, each using the same syntax as dataset_scalyr_query's filter. Filters made only of field equality clauses (e.g. "Environment = 'staging' Project = 'backend'") are combined into a single "(a) or (b)" query and the matches split back per filter; any other filter makes the batch fall back to one query per filter.
+
+        start_time: Start time for the query, in the same formats as dataset_scalyr_query, e.g. "4h", "2024-01-15 10:00:00" or a timestamp in seconds since 1/1/1970. (default: "4h")
+
+        end_time: End time for the query, in the same formats as start_time. (default: "0h")
+
+        max_count: Maximum number of records to return per filter. You may specify a value from 1 to 5000. (default: 100)
+
+        columns: [Optional] fields to return for each log message, as a comma-delimited list. Fields used by the filters are added so matches can be attributed. (default: "", which returns all columns)
+
+    Returns:
+        dict: {"results": [...]} with one entry per filter, in the same order as filters. Each entry has the filter and its matches; entries from a combined query carry no continuationToken, use dataset_scalyr_query to page further.
+    """
+    error = _validate_query(start_time, end_time, max_count)
+    if error:
         return {
-            "error": f"URL Error: {e.reason}"
+            "error": error
         }
-    except Exception as e:
+
+    template = _body_template()
+    if template is None:
         return {
-            "error": f"Unexpected error: {str(e)}"
+            "error": "SCALYR_API_TOKEN environment variable not set"
+        }
+
+    def query_one(filter: str) -> dict[str, Any]:
+        body = _build_body(
+            template, filter, start_time, end_time, max_count, columns, None
+        )
+        return {"filter": filter, **_post_query(body)}
+
+    parsed = [_filter_clauses(filter) for filter in filters]
+    clauses = [c for c in parsed if c is not None]
+    combined_count = max_count * len(filters)
+
+    # Fall back to one request per filter when matches can't be attributed
+    # client-side or the combined page would exceed the API limit
+    if (
+        len(filters) < 2
+        or len(clauses) < len(filters)
+        or combined_count > _MAX_COUNT_LIMIT
+    ):
+        return {"results": [query_one(filter) for filter in filters]}
+
+    combined_columns = columns
+    if columns:
+        requested = [c.strip() for c in columns.split(",") if c.strip()]
+        needed = [f for c in clauses for f, _ in c if f not in requested]
+        combined_columns = ",".join(requested + list(dict.fromkeys(needed)))
+
+    body = _build_body(
+        template,
+        " or ".join(f"({filter})" for filter in filters),
+        start_time,
+        end_time,
+        combined_count,
+        combined_columns,
+        None,
+    )
+    result = _post_query(body)
+    if "error" in result:
+        return result
+
+    sessions = result.get("sessions") or {}
+    per_filter: list[list[dict[str, Any]]] = [[] for _ in filters]
+    unattributed = 0
+    for event in result.get("matches", []):
+        attributed = False
+        for i, filter_clauses in enumerate(clauses):
+            if _event_matches(event, sessions, filter_clauses):
+                per_filter[i].append(event)
+                attributed = True
+        if not attributed:
+            unattributed += 1
+
+    # The server matched events that none of the filters claim client-side
+    # (e.g. a numeric 200.0 against '200'), so the split can't be trusted
+    if unattributed:
+        return {"results": [query_one(filter) for filter in filters]}
+
+    # A truncated combined page may have crowded out matches for some filters,
+    # and a filter with more than max_count matches has more than this entry
+    # can hold; re-query those on their own so they get a continuationToken
+    truncated = bool(result.get("continuationToken"))
+
+    results = []
+    for filter, matches in zip(filters, per_filter):
+        if len(matches) > max_count or (truncated and len(matches) < max_count):
+            results.append(query_one(filter))
+            continue
+
+        entry: dict[str, Any] = {
+            "filter": filter,
+            "status": result.get("status"),
+            "matches": matches,
         }
+        used = {event.get("session") for event in matches}
+        if sessions:
+            entry["sessions"] = {k: v for k, v in sessions.items() if k in used}
+        results.append(entry)
+
+    return {"results": results}
@@ -1,26 +1,91 @@
 """Tests for dataset_scalyr_query tool."""
 
+import gzip
+import io
 import sys
 import json
 from pathlib import Path
-from unittest.mock import patch, MagicMock
-from urllib.error import HTTPError, URLError
+from typing import Any
+from unittest.mock import AsyncMock, patch, MagicMock
+import httpx
 import pytest
+from urllib3 import HTTPResponse
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
 # Add src to Python path
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
 
 from tools.dataset_scalyr_query import dataset_scalyr_query as dataset_scalyr_query_tool
+from tools.dataset_scalyr_query import (
+    dataset_scalyr_query_batch as dataset_scalyr_query_batch_tool,
+)
+from tools.dataset_scalyr_query import (
+    dataset_scalyr_query_many as dataset_scalyr_query_many_tool,
+)
 
 # Get the actual function from the FunctionTool wrapper
 dataset_scalyr_query = dataset_scalyr_query_tool.fn
+dataset_scalyr_query_many = dataset_scalyr_query_many_tool.fn
+dataset_scalyr_query_batch = dataset_scalyr_query_batch_tool.fn
+
+# The tools package re-exports the tool under the module's name, so fetch the
+# module itself from sys.modules to reach its private state
+dataset_scalyr_query_module = sys.modules["tools.dataset_scalyr_query"]
+
+
+def make_response(payload: object, status: int = 200, reason: str = "OK") -> MagicMock:
+    """Build a mock urllib3 response carrying a JSON (or raw bytes) payload."""
+    response = MagicMock()
+    response.status = status
+    response.reason = reason
+    if isinstance(payload, bytes):
+        response.data = payload
+    else:
+        response.data = json.dumps(payload).encode("utf-8")
+    return response
+
+
+class StreamingResponse(io.BytesIO):
+    """File-like stand-in for a urllib3 response created with preload_content=False."""
+
+    status = 200
+    reason = "OK"
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.conn = MagicMock()
+        self.drain_conn = self.conn.drain_conn
+        self.release_conn = self.conn.release_conn
+
+
+def make_async_response(payload: object, status: int = 200) -> httpx.Response:
+    """Build an httpx response carrying a JSON (or raw bytes) payload."""
+    if isinstance(payload, bytes):
+        return httpx.Response(status, content=payload)
+    return httpx.Response(status, content=json.dumps(payload).encode("utf-8"))
+
+
+def make_async_client(*responses: httpx.Response) -> MagicMock:
+    """Build a mock httpx client returning the given responses in order."""
+    client = MagicMock()
+    client.__aenter__.return_value = client
+    client.post = AsyncMock(side_effect=list(responses))
+    return client
+
+
+@pytest.fixture(autouse=True)
+def reset_module_state(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Forget the memoized API token and cached results between tests."""
+    monkeypatch.setattr(dataset_scalyr_query_module, "_TOKEN", None)
+    dataset_scalyr_query_module._CACHE.clear()
+
 
 class TestDatasetScalyrQuery:
     """Test the dataset_scalyr_query tool."""
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_successful_query(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_successful_query(self, mock_pool: MagicMock) -> None:
         """Test successful API query."""
         # Mock API response
         mock_response_data = {
@@ -35,10 +100,7 @@ class TestDatasetScalyrQuery:
             "continuationToken": "next-token-456"
         }
         
-        mock_response = MagicMock()
-        mock_response.read.return_value = json.dumps(mock_response_data).encode("utf-8")
-        mock_response.__enter__.return_value = mock_response
-        mock_urlopen.return_value = mock_response
+        mock_pool.urlopen.return_value = make_response(mock_response_data)
 
         # Call the function
         result = dataset_scalyr_query(
@@ -61,14 +123,11 @@ class TestDatasetScalyrQuery:
         assert "SCALYR_API_TOKEN" in result["error"]
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_query_with_custom_parameters(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_query_with_custom_parameters(self, mock_pool: MagicMock) -> None:
         """Test query with custom parameters."""
         mock_response_data = {"status": "success", "matches": []}
-        mock_response = MagicMock()
-        mock_response.read.return_value = json.dumps(mock_response_data).encode("utf-8")
-        mock_response.__enter__.return_value = mock_response
-        mock_urlopen.return_value = mock_response
+        mock_pool.urlopen.return_value = make_response(mock_response_data)
 
         # Call with custom parameters
         result = dataset_scalyr_query(
@@ -81,12 +140,11 @@ class TestDatasetScalyrQuery:
         )
 
         # Verify the request was made
-        assert mock_urlopen.called
-        call_args = mock_urlopen.call_args
-        request = call_args[0][0]
-        
+        assert mock_pool.urlopen.called
+        call_args = mock_pool.urlopen.call_args
+
         # Verify request body
-        request_body = json.loads(request.data.decode("utf-8"))
+        request_body = json.loads(call_args.kwargs["body"])
         assert request_body["filter"] == "error"
         assert request_body["startTime"] == "1h"
         assert request_body["endTime"] == "0h"
@@ -97,50 +155,34 @@ class TestDatasetScalyrQuery:
         assert request_body["token"] == "test-token-123"
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_query_with_default_parameters(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_query_with_default_parameters(self, mock_pool: MagicMock) -> None:
         """Test query with default parameters."""
         mock_response_data = {"status": "success"}
-        mock_response = MagicMock()
-        mock_response.read.return_value = json.dumps(mock_response_data).encode("utf-8")
-        mock_response.__enter__.return_value = mock_response
-        mock_urlopen.return_value = mock_response
+        mock_pool.urlopen.return_value = make_response(mock_response_data)
 
         # Call with only required parameter
         result = dataset_scalyr_query(filter="test")
 
         # Verify the request
-        request = mock_urlopen.call_args[0][0]
-        request_body = json.loads(request.data.decode("utf-8"))
+        request_body = json.loads(mock_pool.urlopen.call_args.kwargs["body"])
         
         # Check default values
         assert request_body["startTime"] == "4h"
         assert request_body["endTime"] == "0h"
         assert request_body["maxCount"] == 100
-        assert request_body["columns"] == ""
+        assert "columns" not in request_body
         assert "continuationToken" not in request_body
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_http_error_handling(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_http_error_handling(self, mock_pool: MagicMock) -> None:
         """Test handling of HTTP errors."""
-        # Create mock HTTP error
+        # Mock HTTP error response
         error_response = {"message": "Invalid query", "code": "BAD_REQUEST"}
-        
-        # Create a proper mock for the error's file pointer
-        mock_fp = MagicMock()
-        mock_error = HTTPError(
-            url="https://app.scalyr.com/api/query",
-            code=400,
-            msg="Bad Request",
-            hdrs={},
-            fp=mock_fp
-        )
-        # Set up the read method to return the error response
-        mock_error.read = MagicMock(return_value=json.dumps(error_response).encode("utf-8"))
-        mock_error.fp = mock_fp  # Ensure fp attribute is set
-        
-        mock_urlopen.side_effect = mock_error
+        mock_pool.urlopen.return_value = make_response(
+            error_response, status=400, reason="Bad Request"
+        )
 
         # Call the function
         result = dataset_scalyr_query(filter="invalid")
@@ -154,10 +196,14 @@ class TestDatasetScalyrQuery:
         assert result["details"]["code"] == "BAD_REQUEST"
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_url_error_handling(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_url_error_handling(self, mock_pool: MagicMock) -> None:
         """Test handling of URL errors (network issues)."""
-        mock_urlopen.side_effect = URLError("Network unreachable")
+        mock_pool.urlopen.side_effect = MaxRetryError(
+            mock_pool,
+            "/api/query",
+            NewConnectionError(mock_pool, "Network unreachable"),
+        )
 
         result = dataset_scalyr_query(filter="test")
 
@@ -166,10 +212,10 @@ class TestDatasetScalyrQuery:
         assert "URL Error" in result["error"]
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_unexpected_error_handling(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_unexpected_error_handling(self, mock_pool: MagicMock) -> None:
         """Test handling of unexpected errors."""
-        mock_urlopen.side_effect = Exception("Unexpected error occurred")
+        mock_pool.urlopen.side_effect = Exception("Unexpected error occurred")
 
         result = dataset_scalyr_query(filter="test")
 
@@ -178,38 +224,30 @@ class TestDatasetScalyrQuery:
         assert "Unexpected error" in result["error"]
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_api_endpoint_and_headers(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_api_endpoint_and_headers(self, mock_pool: MagicMock) -> None:
         """Test that correct endpoint and headers are used."""
         mock_response_data = {"status": "success"}
-        mock_response = MagicMock()
-        mock_response.read.return_value = json.dumps(mock_response_data).encode("utf-8")
-        mock_response.__enter__.return_value = mock_response
-        mock_urlopen.return_value = mock_response
+        mock_pool.urlopen.return_value = make_response(mock_response_data)
 
         dataset_scalyr_query(filter="test")
 
         # Verify the request
-        request = mock_urlopen.call_args[0][0]
-        
-        # Check URL
-        assert request.full_url == "https://app.scalyr.com/api/query"
-        
+        call_args = mock_pool.urlopen.call_args
+
+        # Check method and endpoint
+        assert call_args.args == ("POST", "/api/query")
+
         # Check headers
-        assert request.headers["Content-type"] == "application/json"
-        
-        # Check method
-        assert request.method == "POST"
+        assert call_args.kwargs["headers"]["Content-Type"] == "application/json"
+        assert call_args.kwargs["headers"]["Accept-Encoding"] == "gzip"
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_returns_dict_not_string(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_returns_dict_not_string(self, mock_pool: MagicMock) -> None:
         """Test that the function returns a dict, not a JSON string."""
         mock_response_data = {"status": "success", "data": [1, 2, 3]}
-        mock_response = MagicMock()
-        mock_response.read.return_value = json.dumps(mock_response_data).encode("utf-8")
-        mock_response.__enter__.return_value = mock_response
-        mock_urlopen.return_value = mock_response
+        mock_pool.urlopen.return_value = make_response(mock_response_data)
 
         result = dataset_scalyr_query(filter="test")
 
@@ -220,21 +258,12 @@ class TestDatasetScalyrQuery:
         assert result["data"] == [1, 2, 3]
 
     @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
-    @patch("urllib.request.urlopen")
-    def test_returns_dict_not_string(self, mock_urlopen: MagicMock) -> None:
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_non_json_error_body(self, mock_pool: MagicMock) -> None:
         """Test handling error_body that is not valid JSON."""
-        mock_fp = MagicMock()
-        mock_error = HTTPError(
-            url="https://app.scalyr.com/api/query",
-            code=500,
-            msg="Internal Server Error",
-            hdrs={},
-            fp=mock_fp
-        )
-        mock_error.read = MagicMock(return_value=b"Non-JSON error response")
-        mock_error.fp = mock_fp
-        
-        mock_urlopen.side_effect = mock_error
+        mock_pool.urlopen.return_value = make_response(
+            b"Non-JSON error response", status=500, reason="Internal Server Error"
+        )
 
         result = dataset_scalyr_query(filter="test")
 
@@ -242,5 +271,516 @@ class TestDatasetScalyrQuery:
         assert "error" in result
         assert "HTTP 500" in result["error"]
         assert "details" in result
-        assert result["details"] == "Non-JSON error response"  
-      
\ No newline at end of file
+        assert result["details"] == "Non-JSON error response"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_malformed_json_error_body(self, mock_pool: MagicMock) -> None:
+        """Test handling error_body that looks like JSON but fails to parse."""
+        mock_pool.urlopen.return_value = make_response(
+            b"{not json", status=502, reason="Bad Gateway"
+        )
+
+        result = dataset_scalyr_query(filter="test")
+
+        assert "HTTP 502" in result["error"]
+        assert result["details"] == "{not json"
+
+    @pytest.mark.parametrize("stream", [False, True])
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_gzip_response_is_decoded(self, mock_pool: MagicMock, stream: bool) -> None:
+        """Test that gzip-encoded responses are transparently inflated."""
+        mock_response_data = {"status": "success", "matches": [{"message": "a"}]}
+        mock_pool.urlopen.return_value = HTTPResponse(
+            body=io.BytesIO(gzip.compress(json.dumps(mock_response_data).encode())),
+            headers={"Content-Encoding": "gzip"},
+            status=200,
+            preload_content=not stream,
+        )
+
+        result = dataset_scalyr_query(filter="test", stream=stream)
+
+        assert result == mock_response_data
+
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_request_body_is_compact(
+        self, mock_pool: MagicMock, use_orjson: bool, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Test that the request body has no separator whitespace."""
+        if not use_orjson:
+            monkeypatch.setattr(dataset_scalyr_query_module, "orjson", None)
+        mock_pool.urlopen.return_value = make_response({"status": "success"})
+
+        dataset_scalyr_query(filter="test", columns="timestamp,message")
+
+        body = mock_pool.urlopen.call_args.kwargs["body"]
+        assert b", " not in body
+        assert b": " not in body
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_api_token_is_memoized(self, mock_pool: MagicMock) -> None:
+        """Test that the API token is read once and reused."""
+        mock_pool.urlopen.return_value = make_response({"status": "success"})
+
+        dataset_scalyr_query(filter="test")
+        with patch.dict("os.environ", {}, clear=True):
+            result = dataset_scalyr_query(filter="test")
+
+        assert "error" not in result
+        request_body = json.loads(mock_pool.urlopen.call_args.kwargs["body"])
+        assert request_body["token"] == "test-token-123"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_auto_paginate_follows_continuation_token(
+        self, mock_pool: MagicMock
+    ) -> None:
+        """Test that auto_paginate fetches pages until enough matches are found."""
+        mock_pool.urlopen.side_effect = [
+            make_response({"matches": [{"message": "1"}], "continuationToken": "t1"}),
+            make_response({"matches": [{"message": "2"}], "continuationToken": "t2"}),
+            make_response({"matches": [{"message": "3"}], "continuationToken": "t3"}),
+        ]
+
+        result = dataset_scalyr_query(filter="test", max_count=1, auto_paginate=2)
+
+        assert [m["message"] for m in result["matches"]] == ["1", "2"]
+        assert result["continuationToken"] == "t2"
+        assert mock_pool.urlopen.call_count == 2
+        second_body = json.loads(mock_pool.urlopen.call_args.kwargs["body"])
+        assert second_body["continuationToken"] == "t1"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_auto_paginate_keeps_matches_on_page_error(
+        self, mock_pool: MagicMock
+    ) -> None:
+        """Test that a failing later page keeps collected matches and the token."""
+        mock_pool.urlopen.side_effect = [
+            make_response({"matches": [{"message": "1"}], "continuationToken": "t1"}),
+            make_response(b"busy", status=503, reason="Service Unavailable"),
+        ]
+
+        result = dataset_scalyr_query(filter="test", max_count=1, auto_paginate=5)
+
+        assert [m["message"] for m in result["matches"]] == ["1"]
+        assert result["continuationToken"] == "t1"
+        assert "HTTP 503" in result["error"]
+        assert result["details"] == "busy"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_auto_paginate_stops_when_exhausted(self, mock_pool: MagicMock) -> None:
+        """Test that auto_paginate stops when no continuation token is returned."""
+        mock_pool.urlopen.side_effect = [
+            make_response({"matches": [{"message": "1"}], "continuationToken": "t1"}),
+            make_response({"matches": [{"message": "2"}]}),
+        ]
+
+        result = dataset_scalyr_query(filter="test", max_count=1, auto_paginate=10)
+
+        assert len(result["matches"]) == 2
+        assert "continuationToken" not in result
+        assert mock_pool.urlopen.call_count == 2
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_auto_paginate_stops_without_progress(self, mock_pool: MagicMock) -> None:
+        """Test that an empty page with a repeated token ends pagination."""
+        mock_pool.urlopen.return_value = make_response(
+            {"matches": [], "continuationToken": "t1"}
+        )
+
+        result = dataset_scalyr_query(filter="test", max_count=10, auto_paginate=100)
+
+        assert mock_pool.urlopen.call_count == 2
+        assert result["continuationToken"] == "t1"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_auto_paginate_caps_page_count(self, mock_pool: MagicMock) -> None:
+        """Test that short pages with fresh tokens stop at the page cap."""
+        mock_pool.urlopen.side_effect = [
+            make_response({"matches": [{"message": "x"}], "continuationToken": f"t{i}"})
+            for i in range(10)
+        ]
+
+        result = dataset_scalyr_query(filter="test", max_count=10, auto_paginate=20)
+
+        # ceil(20 / 10) pages plus the extra allowance
+        assert mock_pool.urlopen.call_count == 4
+        assert len(result["matches"]) == 4
+        assert result["continuationToken"] == "t3"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_stream_parses_response_incrementally(self, mock_pool: MagicMock) -> None:
+        """Test that stream=True parses the body from the file-like response."""
+        mock_response_data = {
+            "status": "success",
+            "matches": [{"message": "a", "value": 1.5}, {"message": "b"}],
+            "continuationToken": "next-token-456",
+        }
+        mock_response = StreamingResponse(json.dumps(mock_response_data).encode())
+        mock_pool.urlopen.return_value = mock_response
+
+        result = dataset_scalyr_query(filter="test", stream=True)
+
+        assert result == mock_response_data
+        assert mock_pool.urlopen.call_args.kwargs["preload_content"] is False
+        mock_response.release_conn.assert_called_once()
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_stream_drains_connection_on_parse_error(
+        self, mock_pool: MagicMock
+    ) -> None:
+        """Test that a truncated streamed body is drained before release."""
+        mock_response = StreamingResponse(b'{"status": "success", "matches": [{"me')
+        mock_pool.urlopen.return_value = mock_response
+
+        result = dataset_scalyr_query(filter="test", stream=True)
+
+        assert "error" in result
+        assert [c[0] for c in mock_response.conn.method_calls] == [
+            "drain_conn",
+            "release_conn",
+        ]
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_absolute_time_queries_are_cached(self, mock_pool: MagicMock) -> None:
+        """Test that repeated queries over an absolute range hit the cache."""
+        mock_pool.urlopen.return_value = make_response({"status": "success"})
+
+        first = dataset_scalyr_query(
+            filter="test", start_time="1700000000", end_time="1700003600"
+        )
+        second = dataset_scalyr_query(
+            filter="test", start_time="1700000000", end_time="1700003600"
+        )
+
+        assert mock_pool.urlopen.call_count == 1
+        assert first == second
+        assert first is not second
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_cached_results_are_independent(self, mock_pool: MagicMock) -> None:
+        """Test that mutating a returned result doesn't alter the cached entry."""
+        mock_pool.urlopen.return_value = make_response({
+            "status": "success",
+            "matches": [{"message": "a", "session": "s1"}],
+            "sessions": {"s1": {"serverHost": "h1"}},
+        })
+        kwargs = {"filter": "test", "start_time": "1700000000", "end_time": "1700003600"}
+
+        first = dataset_scalyr_query(**kwargs)
+        first["matches"].append({"message": "b"})
+        first["sessions"]["s1"]["serverHost"] = "changed"
+        second = dataset_scalyr_query(**kwargs)
+        second["matches"].clear()
+        third = dataset_scalyr_query(**kwargs)
+
+        assert mock_pool.urlopen.call_count == 1
+        assert third["matches"] == [{"message": "a", "session": "s1"}]
+        assert third["sessions"] == {"s1": {"serverHost": "h1"}}
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_relative_and_continued_queries_not_cached(
+        self, mock_pool: MagicMock
+    ) -> None:
+        """Test that relative-time and continuation queries always hit the API."""
+        mock_pool.urlopen.return_value = make_response({"status": "success"})
+
+        dataset_scalyr_query(filter="test")
+        dataset_scalyr_query(filter="test")
+        for _ in range(2):
+            dataset_scalyr_query(
+                filter="test",
+                start_time="1700000000",
+                end_time="1700003600",
+                continuation_token="token-123",
+            )
+
+        assert mock_pool.urlopen.call_count == 4
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {"max_count": 0},
+            {"max_count": 10000},
+            {"start_time": ""},
+            {"end_time": "   "},
+            {"start_time": 4},
+        ],
+    )
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_invalid_arguments_rejected_locally(
+        self, mock_pool: MagicMock, kwargs: dict[str, Any]
+    ) -> None:
+        """Test that invalid arguments fail without calling the API."""
+        result = dataset_scalyr_query(filter="test", **kwargs)
+
+        assert "error" in result
+        assert not mock_pool.urlopen.called
+
+    @pytest.mark.parametrize(
+        "start_time", ["1w", "4 hours", "2024-01-15 10:00:00", "today"]
+    )
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_scalyr_time_formats_passed_through(
+        self, mock_pool: MagicMock, start_time: str
+    ) -> None:
+        """Test that time formats are left for the API to interpret."""
+        mock_pool.urlopen.return_value = make_response({"status": "success"})
+
+        result = dataset_scalyr_query(filter="test", start_time=start_time)
+
+        assert "error" not in result
+        request_body = json.loads(mock_pool.urlopen.call_args.kwargs["body"])
+        assert request_body["startTime"] == start_time
+
+
+class TestDatasetScalyrQueryMany:
+    """Test the dataset_scalyr_query_many tool."""
+
+    @pytest.mark.asyncio
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    async def test_results_keep_query_order(self) -> None:
+        """Test that each query gets its own result, in order."""
+        client = make_async_client(
+            make_async_response({"status": "success", "matches": [{"message": "a"}]}),
+            make_async_response({"status": "success", "matches": [{"message": "b"}]}),
+        )
+        with patch.object(
+            dataset_scalyr_query_module, "_new_client", return_value=client
+        ):
+            result = await dataset_scalyr_query_many(
+                queries=[{"filter": "a"}, {"filter": "b", "max_count": 5}]
+            )
+
+        assert [r["matches"][0]["message"] for r in result["results"]] == ["a", "b"]
+        bodies = [json.loads(c.kwargs["content"]) for c in client.post.call_args_list]
+        assert bodies[0]["filter"] == "a"
+        assert bodies[1]["maxCount"] == 5
+        assert bodies[1]["token"] == "test-token-123"
+        client.__aexit__.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    async def test_retries_on_server_error(self) -> None:
+        """Test that 429/5xx responses are retried."""
+        client = make_async_client(
+            make_async_response(b"busy", status=429),
+            make_async_response({"status": "success"}),
+        )
+        with patch.object(
+            dataset_scalyr_query_module, "_new_client", return_value=client
+        ):
+            result = await dataset_scalyr_query_many(queries=[{"filter": "test"}])
+
+        assert client.post.call_count == 2
+        assert result["results"][0]["status"] == "success"
+
+    @pytest.mark.asyncio
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    async def test_client_error_not_retried(self) -> None:
+        """Test that 4xx responses are returned as errors without retrying."""
+        client = make_async_client(
+            make_async_response({"code": "BAD_REQUEST"}, status=400),
+        )
+        with patch.object(
+            dataset_scalyr_query_module, "_new_client", return_value=client
+        ):
+            result = await dataset_scalyr_query_many(queries=[{"filter": "bad"}])
+
+        assert client.post.call_count == 1
+        assert "HTTP 400" in result["results"][0]["error"]
+        assert result["results"][0]["details"]["code"] == "BAD_REQUEST"
+
+    @pytest.mark.asyncio
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    async def test_invalid_query_rejected_locally(self) -> None:
+        """Test that an invalid query fails without affecting the others."""
+        client = make_async_client(make_async_response({"status": "success"}))
+        with patch.object(
+            dataset_scalyr_query_module, "_new_client", return_value=client
+        ):
+            result = await dataset_scalyr_query_many(
+                queries=[{"filter": "a", "max_count": 0}, {"filter": "b"}]
+            )
+
+        assert client.post.call_count == 1
+        assert "max_count" in result["results"][0]["error"]
+        assert result["results"][1]["status"] == "success"
+
+    @pytest.mark.asyncio
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    async def test_wrongly_typed_entries_fail_individually(self) -> None:
+        """Test that entries with wrongly typed values don't fail the batch."""
+        client = make_async_client(make_async_response({"status": "success"}))
+        with patch.object(
+            dataset_scalyr_query_module, "_new_client", return_value=client
+        ):
+            result = await dataset_scalyr_query_many(
+                queries=[
+                    {"filter": "a", "start_time": 1700000000},
+                    {"filter": "b", "end_time": None},
+                    {"filter": "c", "max_count": "10"},
+                    {"filter": "d"},
+                ]
+            )
+
+        errors = [r.get("error") for r in result["results"]]
+        assert "start_time" in errors[0]
+        assert "end_time" in errors[1]
+        assert "max_count" in errors[2]
+        assert result["results"][3]["status"] == "success"
+        assert client.post.call_count == 1
+
+    @pytest.mark.asyncio
+    @patch.dict("os.environ", {}, clear=True)
+    async def test_missing_api_token(self) -> None:
+        """Test behavior when API token is missing."""
+        result = await dataset_scalyr_query_many(queries=[{"filter": "test"}])
+
+        assert "SCALYR_API_TOKEN" in result["error"]
+
+
+class TestDatasetScalyrQueryBatch:
+    """Test the dataset_scalyr_query_batch tool."""
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_combines_filters_and_splits_matches(self, mock_pool: MagicMock) -> None:
+        """Test that equality filters are ORed into one query and demultiplexed."""
+        mock_pool.urlopen.return_value = make_response({
+            "status": "success",
+            "matches": [
+                {"message": "a", "session": "s1", "attributes": {"app": "api"}},
+                {"message": "b", "session": "s2", "attributes": {"app": "web"}},
+                {"message": "c", "session": "s1", "attributes": {"app": "api"}},
+            ],
+            "sessions": {"s1": {"serverHost": "h1"}, "s2": {"serverHost": "h2"}},
+        })
+
+        result = dataset_scalyr_query_batch(
+            filters=["app == 'api'", "app == 'web' serverHost == 'h2'"],
+            max_count=10,
+        )
+
+        assert mock_pool.urlopen.call_count == 1
+        request_body = json.loads(mock_pool.urlopen.call_args.kwargs["body"])
+        assert request_body["filter"] == (
+            "(app == 'api') or (app == 'web' serverHost == 'h2')"
+        )
+        assert request_body["maxCount"] == 20
+
+        api, web = result["results"]
+        assert [m["message"] for m in api["matches"]] == ["a", "c"]
+        assert api["sessions"] == {"s1": {"serverHost": "h1"}}
+        assert [m["message"] for m in web["matches"]] == ["b"]
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_falls_back_for_free_text_filters(self, mock_pool: MagicMock) -> None:
+        """Test that filters that can't be attributed are queried one by one."""
+        mock_pool.urlopen.side_effect = [
+            make_response({"status": "success", "matches": [{"message": "a"}]}),
+            make_response({"status": "success", "matches": [{"message": "b"}]}),
+        ]
+
+        result = dataset_scalyr_query_batch(filters=["app == 'api'", "'timeout'"])
+
+        assert mock_pool.urlopen.call_count == 2
+        calls = mock_pool.urlopen.call_args_list
+        bodies = [json.loads(c.kwargs["body"]) for c in calls]
+        assert [b["filter"] for b in bodies] == ["app == 'api'", "'timeout'"]
+        assert [r["filter"] for r in result["results"]] == ["app == 'api'", "'timeout'"]
+        assert result["results"][1]["matches"] == [{"message": "b"}]
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_requeries_short_filters_when_truncated(self, mock_pool: MagicMock) -> None:
+        """Test that a truncated page re-queries filters that came back short."""
+        mock_pool.urlopen.side_effect = [
+            make_response({
+                "status": "success",
+                "matches": [{"attributes": {"app": "api"}, "message": m} for m in "ab"],
+                "continuationToken": "more",
+            }),
+            make_response({"status": "success", "matches": [{"message": "web"}]}),
+        ]
+
+        result = dataset_scalyr_query_batch(
+            filters=["app == 'api'", "app == 'web'"], max_count=2
+        )
+
+        assert mock_pool.urlopen.call_count == 2
+        assert len(result["results"][0]["matches"]) == 2
+        assert result["results"][1]["matches"] == [{"message": "web"}]
+        retry_body = json.loads(mock_pool.urlopen.call_args.kwargs["body"])
+        assert retry_body["filter"] == "app == 'web'"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_requeries_filters_over_max_count(self, mock_pool: MagicMock) -> None:
+        """Test that a filter with more than max_count matches is re-queried."""
+        mock_pool.urlopen.side_effect = [
+            make_response({
+                "status": "success",
+                "matches": [
+                    {"attributes": {"app": "api"}, "message": m} for m in "abc"
+                ],
+            }),
+            make_response({
+                "status": "success",
+                "matches": [{"message": "a"}, {"message": "b"}],
+                "continuationToken": "next",
+            }),
+        ]
+
+        result = dataset_scalyr_query_batch(
+            filters=["app == 'api'", "app == 'web'"], max_count=2
+        )
+
+        assert mock_pool.urlopen.call_count == 2
+        api, web = result["results"]
+        assert api["continuationToken"] == "next"
+        assert web["matches"] == []
+        retry_body = json.loads(mock_pool.urlopen.call_args.kwargs["body"])
+        assert retry_body["filter"] == "app == 'api'"
+
+    @patch.dict("os.environ", {"SCALYR_API_TOKEN": "test-token-123"})
+    @patch("tools.dataset_scalyr_query._POOL")
+    def test_falls_back_for_unattributed_matches(self, mock_pool: MagicMock) -> None:
+        """Test that matches no filter claims make every filter run alone."""
+        mock_pool.urlopen.side_effect = [
+            make_response({
+                "status": "success",
+                "matches": [
+                    {"attributes": {"app": "api"}, "message": "a"},
+                    {"attributes": {"status": 200.0}, "message": "b"},
+                ],
+            }),
+            make_response({"status": "success", "matches": [{"message": "a"}]}),
+            make_response({"status": "success", "matches": [{"message": "b"}]}),
+        ]
+
+        result = dataset_scalyr_query_batch(
+            filters=["app == 'api'", "status == '200'"], max_count=10
+        )
+
+        assert mock_pool.urlopen.call_count == 3
+        calls = mock_pool.urlopen.call_args_list[1:]
+        bodies = [json.loads(c.kwargs["body"]) for c in calls]
+        assert [b["filter"] for b in bodies] == ["app == 'api'", "status == '200'"]
+        assert result["results"][1]["matches"] == [{"message": "b"}]